@@ -1,12 +1,15 @@
 #!/usr/bin/env python
 import argparse
 import ctypes
+import cv2
+import numpy as np
 import os
 import pywintypes
 import win32gui
 import win32ui
 import win32con
 import extract_text
+import recording
 import time
 import templates
 from PIL import ImageGrab
@@ -39,6 +42,11 @@ def take_snapshot(hwnd, pid):
 
     return filename
 
+def grab_snapshot(hwnd):
+    bounding_box = win32gui.GetWindowRect(hwnd)
+
+    return cv2.cvtColor(np.array(ImageGrab.grab(bounding_box)), cv2.COLOR_RGB2BGR)
+
 def setup():
     for directory in ['input', 'output', 'templates']:
         os.makedirs(directory, exist_ok=True)
@@ -50,6 +58,9 @@ if __name__ == "__main__":
     parser.set_defaults(dry_run=False)
     parser.add_argument('--debug', dest='debug', action='store_true')
     parser.set_defaults(debug=False)
+    parser.add_argument('--record', dest='record', default=None)
+    parser.add_argument('--no_patches', dest='patches', action='store_false')
+    parser.set_defaults(patches=True)
 
     args = parser.parse_args()
 
@@ -65,11 +76,18 @@ if __name__ == "__main__":
         win32gui.ShowWindow(hwnd, 5)
         win32gui.SetForegroundWindow(hwnd)
         time.sleep(0.5)
-        screenshot = take_snapshot(hwnd, os.getpid())
-        extract_text.process(screenshot, {
+        options = {
             'debug': args.debug,
             'dry_run': args.dry_run,
             'resolution': resolution,
             'window_title': window_title
-            })
+            }
+
+        if args.record:
+            # Keep the frame in memory; the recording stores what it needs
+            options['recorder'] = recording.SessionRecorder(args.record, args.patches)
+            extract_text.process_image(grab_snapshot(hwnd), str(os.getpid()), options)
+        else:
+            screenshot = take_snapshot(hwnd, os.getpid())
+            extract_text.process(screenshot, options)
 
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+import collections
+import os
+import queue
+import threading
+import time
+
+import cv2
+
+MAX_EVENTS = 500
+SAMPLE_EVERY = 50
+MAX_PENDING_ARTIFACTS = 16
+BOX_COLOR = (0, 0, 255)
+
+class DebugLog:
+    """Collects structured debug events without printing from the matching loops.
+
+    Every event is counted, but only one in `sample_every` of each kind is kept,
+    and at most `max_events` are held at once (oldest are dropped first).
+    """
+
+    def __init__(self, max_events=MAX_EVENTS, sample_every=SAMPLE_EVERY):
+        self.events = collections.deque(maxlen=max_events)
+        self.counts = collections.Counter()
+        self.boxes = []
+        self.sample_every = sample_every
+        self.dropped = 0
+        self.started = time.perf_counter()
+
+    def event(self, name, **fields):
+        self.counts[name] += 1
+
+        if (self.counts[name] - 1) % self.sample_every:
+            return
+
+        self.record(name, **fields)
+
+    def record(self, name, **fields):
+        """Keep an event regardless of sampling, for once-per-frame details."""
+        if len(self.events) == self.events.maxlen:
+            self.dropped += 1
+
+        self.events.append((time.perf_counter() - self.started, name, fields))
+
+    def box(self, x, y, w, h, label):
+        self.boxes.append((int(x), int(y), int(w), int(h), label))
+
+    def summary(self):
+        lines = ["Debug events: {}".format(dict(self.counts))]
+
+        for (elapsed, name, fields) in self.events:
+            details = ", ".join("{}={}".format(k, v) for k, v in fields.items())
+            lines.append("{:8.3f}s {} {}".format(elapsed, name, details))
+
+        if self.dropped:
+            lines.append("Dropped {} older events".format(self.dropped))
+
+        return lines
+
+    def print_summary(self):
+        print("\n".join(self.summary()))
+
+class ArtifactWriter:
+    """Writes images on a background thread so callers never wait on disk.
+
+    Optional artifacts are dropped when `max_pending` writes are already queued;
+    required ones block until there is room.
+    """
+
+    def __init__(self, max_pending=MAX_PENDING_ARTIFACTS):
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.written = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, filename, image, required=False):
+        if required:
+            self.pending.put((filename, image))
+            return
+
+        try:
+            self.pending.put_nowait((filename, image))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            item = self.pending.get()
+
+            if item is None:
+                return
+
+            filename, image = item
+            os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+
+            if cv2.imwrite(filename, image):
+                self.written += 1
+            else:
+                print("Unable to write artifact: {}".format(filename))
+
+def annotate(image, boxes):
+    overlay = image.copy()
+
+    for (x, y, w, h, label) in boxes:
+        cv2.rectangle(overlay, (x, y), (x + w, y + h), BOX_COLOR, 1)
+        cv2.putText(overlay, label, (x + 2, y + 12), cv2.FONT_HERSHEY_SIMPLEX, 0.4, BOX_COLOR, 1)
+
+    return overlay
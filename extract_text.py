@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+import debug_log
 import scrabulizer
 import templates
 
@@ -6,6 +7,7 @@ import cv2
 import numpy as np
 import os
 import sys
+import time
 from math import sqrt
 
 COLUMNS=8
@@ -39,8 +41,21 @@ def closest_rack(x, y, img_width, img_height):
 
     return sorted(distances, key=lambda t: t[0])[0][1]
 
+def cell_bounds(cx, cy, img_width, img_height):
+    max_y = int(img_height * BOARD_RACK_SPLIT_RATIO)
+    x_coords = [int(bx) for bx in np.linspace(0, img_width, COLUMNS + 1)]
+    y_coords = [int(by) for by in np.linspace(0, max_y, ROWS + 1)]
+
+    return (x_coords[cx], y_coords[cy], x_coords[cx + 1], y_coords[cy + 1])
+
+def rack_bounds(slot, img_width, img_height):
+    ry = int(img_height * BOARD_RACK_SPLIT_RATIO)
+    x_coords = [int(rx) for rx in np.linspace(0, img_width, RACK_LETTERS + 1)]
+
+    return (x_coords[slot], ry, x_coords[slot + 1], img_height)
+
 def parse_board(image, board_templates, options):
-    debug = options.get('debug', False)
+    log = options.get('debug_log')
     max_y, max_x = image.shape
 
     rack_cutoff = BOARD_RACK_SPLIT_RATIO * max_y
@@ -58,29 +73,34 @@ def parse_board(image, board_templates, options):
             cx, cy = closest_cell(x, y, max_x, max_y)
 
             if (cx, cy) in board:
-                (cur_letter, cur_match) = board[(cx, cy)]
+                (cur_letter, cur_match, _, _) = board[(cx, cy)]
                 if percent_match > cur_match:
-                    if debug:
-                        print("Found better match at {}, {} with {} ({}%)".format(cx, cy, letter, percent_match * 100))
-                    board.update({(cx, cy): (letter, percent_match)})
+                    if log is not None:
+                        log.event('board_replace', cell=(cx, cy), letter=letter, previous=cur_letter, percent=percent_match * 100)
+                    board.update({(cx, cy): (letter, percent_match, x, y)})
                 else:
-                    if debug:
-                        print("Existing match at {}, {} with {} ({}%) better than {} ({}%)".format(cx, cy, cur_letter, cur_match * 100, letter, percent_match * 100))
+                    if log is not None:
+                        log.event('board_keep', cell=(cx, cy), letter=cur_letter, rejected=letter, percent=percent_match * 100)
                     continue
             else:
-                if debug:
-                    print("Nothing yet for {}, {}, adding {} ({}%)".format(cx, cy, letter, percent_match * 100))
-                board.update({(cx, cy): (letter, percent_match)})
+                if log is not None:
+                    log.event('board_add', cell=(cx, cy), letter=letter, percent=percent_match * 100)
+                board.update({(cx, cy): (letter, percent_match, x, y)})
 
     board = {k:v for k,v in  sorted(board.items(), key=lambda t: (t[0][1], t[0][0]))}
 
-    bonuses = {k: l for k, (l, p) in board.items() if l in bonus_keys}
-    board = {k: l for k, (l, p) in board.items() if l not in bonus_keys}
+    if log is not None:
+        for (letter, percent_match, x, y) in board.values():
+            h, w = board_templates[letter].shape
+            log.box(x, y, w, h, letter)
+
+    bonuses = {k: l for k, (l, p, _, _) in board.items() if l in bonus_keys}
+    board = {k: l for k, (l, p, _, _) in board.items() if l not in bonus_keys}
 
     return board, bonuses
 
 def parse_rack(image, rack_templates, options):
-    debug = options.get('debug', False)
+    log = options.get('debug_log')
     system = options.get('system')
 
     threshold = MATCH_THRESHOLD
@@ -104,21 +124,26 @@ def parse_rack(image, rack_templates, options):
             cx = closest_rack(x, y, max_x, max_y)
 
             if cx in rack:
-                (cur_letter, cur_match) = rack[cx]
+                (cur_letter, cur_match, _, _) = rack[cx]
                 if percent_match > cur_match:
-                    if debug:
-                        print("Found better match at {} with {} ({}%)".format(cx, letter, percent_match * 100))
-                    rack.update({cx: (letter, percent_match)})
+                    if log is not None:
+                        log.event('rack_replace', slot=cx, letter=letter, previous=cur_letter, percent=percent_match * 100)
+                    rack.update({cx: (letter, percent_match, x, y)})
                 else:
-                    if debug:
-                        print("Existing match at {} with {} ({}%) better than {} ({}%)".format(cx, cur_letter, cur_match * 100, letter, percent_match * 100))
+                    if log is not None:
+                        log.event('rack_keep', slot=cx, letter=cur_letter, rejected=letter, percent=percent_match * 100)
                     continue
             else:
-                if debug:
-                    print("Nothing yet for {}, adding {} ({}%)".format(cx, letter, percent_match * 100))
-                rack.update({cx: (letter, percent_match)})
+                if log is not None:
+                    log.event('rack_add', slot=cx, letter=letter, percent=percent_match * 100)
+                rack.update({cx: (letter, percent_match, x, y)})
+
+    if log is not None:
+        for (letter, percent_match, x, y) in rack.values():
+            h, w = rack_templates[letter].shape
+            log.box(x, y, w, h, letter)
 
-    return [letter for _, (letter, _) in sorted(rack.items(), key=lambda t: t[0])]
+    return [letter for _, (letter, _, _, _) in sorted(rack.items(), key=lambda t: t[0])]
 
 def get_template_matches(image, template, threshold=MATCH_THRESHOLD):
     res = cv2.matchTemplate(image, template, cv2.TM_CCOEFF_NORMED)
@@ -138,7 +163,7 @@ def get_system(original_image, system_templates):
     return "windows"
 
 def get_board_bounds(image, icon_templates, options):
-    debug = options.get('debug', False)
+    log = options.get('debug_log')
     system = options.get('system', 'windows')
 
     if system == 'nexus4':
@@ -156,8 +181,8 @@ def get_board_bounds(image, icon_templates, options):
         h, w = template.shape
 
         for (x, y, percent) in get_template_matches(image, template):
-            if debug:
-                print("Found potential {} at {}, {} ({}%)".format(text, x, y, percent*100))
+            if log is not None:
+                log.event('icon_match', icon=text, x=x, y=y, percent=percent * 100)
             min_x = min(min_x, x)
             max_x = max(max_x, x + w)
             min_y = min(min_y, y + h + top_offset)
@@ -218,24 +243,20 @@ def load_image(file_name):
     print("Unable to load image: {}".format(file_name))
     sys.exit(1)
 
-def cleanup_original(input_file, original_image, icon_templates, options):
-    debug = options.get('debug', False)
+def cleanup_original(original_image, icon_templates, options):
+    log = options.get('debug_log')
 
     # Trim original to just include known back/shuffle buttons
     gray, x, y = to_grayscale(original_image)
 
     bounding_box = get_board_bounds(gray, icon_templates, options)
 
-    if debug:
-        print("Bounding box: {}".format(bounding_box))
+    if log is not None:
+        log.record('bounding_box', bounds=bounding_box)
     sub_image, x, y = get_sub_image(original_image, bounding_box)
 
     return sub_image
 
-def load_grayscale(input_file):
-    image = load_image(input_file)
-    return to_grayscale(image)
-
 def print_board(board, bonuses, rack):
     joined_board = board.copy()
     joined_board.update(bonuses)
@@ -250,12 +271,12 @@ def print_board(board, bonuses, rack):
     print("Rack: {}".format("".join(rack)))
 
 def process(input_file, options={}):
-    dry_run = options.get('dry_run', True)
-    debug = options.get('debug', False)
+    original_image = load_image(input_file)
 
-    system_templates = templates.build_system_templates()
+    return process_image(original_image, templates.filename_without_ext(input_file), options)
 
-    original_image = load_image(input_file)
+def crop_board(original_image, options):
+    system_templates = templates.build_system_templates()
 
     if 'window_title' in options and options.get('window_title') == 'Project My Screen App':
         system = 'windows_phone'
@@ -275,32 +296,80 @@ def process(input_file, options={}):
     rack_templates = templates.build_rack_templates(resolution)
     icon_templates = templates.build_icon_templates(resolution)
 
-    filename_base = templates.filename_without_ext(input_file)
-
-    os.makedirs('cleaned_input', exist_ok=True)
-
-    bounded = cleanup_original(input_file, original_image, icon_templates, options)
+    bounded = cleanup_original(original_image, icon_templates, options)
 
-    # Write it to cleaned_input dir
-    cleaned_filename = 'cleaned_input/{}.png'.format(filename_base)
-    cv2.imwrite(cleaned_filename, bounded)
+    return bounded, board_templates, rack_templates
 
-    # Load that as our actual input
-    image, x, y = load_grayscale(cleaned_filename)
-
-    print("{}: {}x{}".format(cleaned_filename, x, y))
-
-    board, bonuses = parse_board(image, board_templates, options)
-    rack = parse_rack(image, rack_templates, options)
-
-    print_board(board, bonuses, rack)
-
-    moves = scrabulizer.scrape_scrabulizer(board, rack, bonuses, dry_run)
+def process_image(original_image, filename_base, options={}):
+    dry_run = options.get('dry_run', True)
+    debug = options.get('debug', False)
+    recorder = options.get('recorder')
+    timings = {}
 
-    print("-----------------")
+    # crop_board adds the detected system to the resolution, so keep what was asked for
+    requested = {'resolution': options.get('resolution', (1920, 1080)), 'window_title': options.get('window_title')}
 
-    for move in moves:
-        print(move)
+    if debug:
+        options['debug_log'] = debug_log.DebugLog()
+
+    artifacts = debug_log.ArtifactWriter()
+
+    try:
+        try:
+            started = time.perf_counter()
+            bounded, board_templates, rack_templates = crop_board(original_image, options)
+            timings['crop'] = time.perf_counter() - started
+
+            # Write it to cleaned_input dir in the background and parse the in-memory copy.
+            # A session recording already keeps these pixels, so skip the PNG then.
+            image, x, y = to_grayscale(bounded)
+
+            if recorder is None:
+                cleaned_filename = 'cleaned_input/{}.png'.format(filename_base)
+                artifacts.write(cleaned_filename, bounded, required=True)
+                print("{}: {}x{}".format(cleaned_filename, x, y))
+
+            started = time.perf_counter()
+            board, bonuses = parse_board(image, board_templates, options)
+            timings['board'] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            rack = parse_rack(image, rack_templates, options)
+            timings['rack'] = time.perf_counter() - started
+        except (Exception, SystemExit) as e:
+            # Replay only sees the crop of parsed frames, so keep the whole screenshot to reproduce this
+            if recorder is not None:
+                recorder.record_raw(filename_base, original_image, requested, repr(e))
+            raise
+
+        # Record before querying the solver, so a failed query still leaves the frame behind
+        if recorder is not None:
+            recorder.record(filename_base, bounded, board, bonuses, rack, timings, options)
+
+        if debug:
+            rack_crop = bounded[int(y * BOARD_RACK_SPLIT_RATIO):, :]
+            artifacts.write('debug_output/{}_matches.png'.format(filename_base), debug_log.annotate(bounded, options['debug_log'].boxes))
+            artifacts.write('debug_output/{}_rack.png'.format(filename_base), rack_crop.copy())
+
+        print_board(board, bonuses, rack)
+
+        started = time.perf_counter()
+        moves = scrabulizer.scrape_scrabulizer(board, rack, bonuses, dry_run)
+        solver_time = time.perf_counter() - started
+
+        print("-----------------")
+
+        for move in moves:
+            print(move)
+
+        if recorder is not None:
+            recorder.record_moves(moves, {'solver': solver_time})
+    finally:
+        artifacts.close()
+
+        if debug:
+            options['debug_log'].record('artifacts', written=artifacts.written, dropped=artifacts.dropped)
+            options['debug_log'].print_summary()
 
     return board, bonuses, rack, moves
 
@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+import extract_text
+
+import cv2
+import json
+import numpy as np
+import os
+import struct
+import zlib
+
+MAGIC = b'SNAPREC1'
+RECORD_HEADER = struct.Struct('<cII')
+KEYFRAME = b'K'
+DELTA = b'D'
+MOVES = b'M'
+RAW = b'R'
+KEYFRAME_INTERVAL = 30
+
+def encode_cells(cells):
+    return [[x, y, letter] for ((x, y), letter) in cells.items()]
+
+def decode_cells(cells):
+    return {(x, y): letter for (x, y, letter) in cells}
+
+def diff_cells(previous, current):
+    changed = {k: current.get(k) for k in set(previous) | set(current) if previous.get(k) != current.get(k)}
+
+    return {k: changed[k] for k in sorted(changed, key=lambda t: (t[1], t[0]))}
+
+def apply_cells(cells, changes):
+    cells = cells.copy()
+
+    for (x, y, letter) in changes:
+        if letter is None:
+            cells.pop((x, y), None)
+        else:
+            cells[(x, y)] = letter
+
+    return cells
+
+def diff_rack(previous, current):
+    length = max(len(previous), len(current))
+    padded_previous = previous + [None] * (length - len(previous))
+    padded_current = current + [None] * (length - len(current))
+
+    return [[i, c] for i, (p, c) in enumerate(zip(padded_previous, padded_current)) if p != c]
+
+def apply_rack(rack, changes, length):
+    rack = rack + [None] * max(0, length - len(rack))
+
+    for (i, letter) in changes:
+        rack[i] = letter
+
+    return rack[:length]
+
+def grid_regions(width, height):
+    board = [extract_text.cell_bounds(x, y, width, height) for y in range(extract_text.ROWS) for x in range(extract_text.COLUMNS)]
+    rack = [extract_text.rack_bounds(slot, width, height) for slot in range(extract_text.RACK_LETTERS)]
+
+    return board + rack
+
+def changed_regions(previous, current):
+    (height, width, _) = current.shape
+
+    return [(min_x, min_y, max_x, max_y) for (min_x, min_y, max_x, max_y) in grid_regions(width, height)
+            if not np.array_equal(previous[min_y:max_y, min_x:max_x], current[min_y:max_y, min_x:max_x])]
+
+def encode_png(image):
+    ok, data = cv2.imencode('.png', image)
+
+    if not ok:
+        raise ValueError("Unable to encode image patch")
+
+    return data.tobytes()
+
+def decode_png(data):
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+def write_record(f, kind, meta, blob):
+    body = zlib.compress(json.dumps(meta).encode('utf-8'))
+
+    f.write(RECORD_HEADER.pack(kind, len(body), len(blob)))
+    f.write(body)
+    f.write(blob)
+
+def read_records(f):
+    """Yields (kind, meta, blob) from the current position, stopping at a truncated record."""
+    while True:
+        header = f.read(RECORD_HEADER.size)
+
+        if len(header) < RECORD_HEADER.size:
+            return
+
+        kind, meta_length, blob_length = RECORD_HEADER.unpack(header)
+        meta = f.read(meta_length)
+        blob = f.read(blob_length)
+
+        if len(meta) < meta_length or len(blob) < blob_length:
+            return
+
+        yield kind, json.loads(zlib.decompress(meta).decode('utf-8')), blob
+
+def check_magic(f, filename):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("{} is not a session recording".format(filename))
+
+def scan(filename):
+    """Finds the end of the valid data and the offsets of the last keyframe and
+    last record, reading only the record headers."""
+    last_keyframe, last_record = None, None
+
+    with open(filename, 'rb') as f:
+        check_magic(f, filename)
+
+        size = os.fstat(f.fileno()).st_size
+        end = len(MAGIC)
+
+        while True:
+            header = f.read(RECORD_HEADER.size)
+
+            if len(header) < RECORD_HEADER.size:
+                break
+
+            kind, meta_length, blob_length = RECORD_HEADER.unpack(header)
+            record_end = end + RECORD_HEADER.size + meta_length + blob_length
+
+            if record_end > size:
+                break
+
+            if kind == KEYFRAME:
+                last_keyframe = end
+
+            last_record = end
+            end = record_end
+            f.seek(end)
+
+    return end, last_keyframe, last_record
+
+def read_meta(filename, offset):
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        kind, meta_length, _ = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+
+        return json.loads(zlib.decompress(f.read(meta_length)).decode('utf-8'))
+
+class SessionReader:
+    """Streams frames back out of a session recording.
+
+    Each parsed frame is a dict holding the full parsed state (`board`,
+    `bonuses`, `rack`), the recorded `moves` (None if the solver never
+    finished) and stage `timings`, and, when the pixels are available, the
+    reconstructed cleaned `image`. Frames that failed before parsing have `raw`
+    set and carry the whole screenshot plus the options needed to crop it
+    again. A truncated record at the end of the file (e.g. from a crash
+    mid-write) ends the stream.
+
+    `start` may point at a keyframe to skip the frames before it.
+    """
+
+    def __init__(self, filename, start=None):
+        self.filename = filename
+        self.start = start
+
+    def __iter__(self):
+        state = None
+        image = None
+        pending = None
+
+        with open(self.filename, 'rb') as f:
+            check_magic(f, self.filename)
+
+            if self.start is not None:
+                f.seek(self.start)
+
+            for (kind, meta, blob) in read_records(f):
+                # Solver results are appended once the query returns, after their frame
+                if kind == MOVES:
+                    if pending is not None and pending['frame'] == meta['frame']:
+                        pending['moves'] = meta['moves']
+                        pending['timings'].update(meta['timings'])
+                    continue
+
+                if pending is not None:
+                    yield pending
+
+                if kind == RAW:
+                    pending = {
+                            'raw': True,
+                            'frame': meta['frame'],
+                            'source': meta['source'],
+                            'resolution': tuple(meta['resolution']),
+                            'window_title': meta['window_title'],
+                            'error': meta['error'],
+                            'moves': None,
+                            'timings': {},
+                            'image': decode_png(blob),
+                            }
+                    continue
+
+                if kind == KEYFRAME:
+                    state = {
+                            'resolution': tuple(meta['resolution']),
+                            'system': meta['system'],
+                            'size': tuple(meta['size']),
+                            'board': decode_cells(meta['board']),
+                            'bonuses': decode_cells(meta['bonuses']),
+                            'rack': meta['rack'],
+                            }
+                    image = decode_png(blob)
+                elif kind == DELTA and state is not None:
+                    state = dict(state,
+                            board=apply_cells(state['board'], meta['board']),
+                            bonuses=apply_cells(state['bonuses'], meta['bonuses']),
+                            rack=apply_rack(state['rack'], meta['rack'], meta['rack_length']))
+
+                    if image is not None and meta['patched']:
+                        image = image.copy()
+                        for (min_x, min_y, max_x, max_y, offset, length) in meta['patches']:
+                            image[min_y:max_y, min_x:max_x] = decode_png(blob[offset:offset + length])
+                    else:
+                        image = None
+                else:
+                    raise ValueError("Corrupt record in {}".format(self.filename))
+
+                pending = dict(state,
+                        raw=False,
+                        keyframe=kind == KEYFRAME,
+                        frame=meta['frame'],
+                        source=meta['source'],
+                        moves=None,
+                        timings=dict(meta['timings']),
+                        image=image)
+
+            if pending is not None:
+                yield pending
+
+class SessionRecorder:
+    """Appends parsed frames to a compact, append-only session recording.
+
+    A frame is stored as a keyframe with the full cleaned image when it is the
+    first one, when its size, resolution or system differs from the previous
+    frame, when patches are on but the previous frame was recorded without
+    them, or when `KEYFRAME_INTERVAL` frames have passed since the last
+    keyframe. Every other frame only stores the cells and rack slots whose
+    letters changed, plus, if `patches` is set, the pixels of every board cell
+    or rack slot that differs from the previous frame, so replay can rebuild
+    the exact image and re-run extraction. Solver moves are appended as a
+    separate record once the query returns, and screenshots that could not be
+    cropped or parsed are kept whole.
+
+    Each record is a small header, a zlib-compressed JSON body and the
+    PNG-encoded pixels. A new run resumes by skimming the record headers and
+    decoding only from the last keyframe.
+    """
+
+    def __init__(self, filename, patches=True):
+        self.filename = filename
+        self.patches = patches
+        self.last = None
+        self.image = None
+        self.frame = 0
+        self.since_keyframe = 0
+
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            end, last_keyframe, last_record = scan(filename)
+
+            if last_keyframe is not None:
+                for frame in SessionReader(filename, last_keyframe):
+                    if not frame['raw']:
+                        self.last = frame
+                        self.image = frame['image']
+                        self.since_keyframe = 0 if frame['keyframe'] else self.since_keyframe + 1
+
+            if last_record is not None:
+                self.frame = read_meta(filename, last_record)['frame'] + 1
+
+            # Drop any partial record left behind before appending to it
+            with open(filename, 'r+b') as f:
+                f.truncate(end)
+        else:
+            with open(filename, 'wb') as f:
+                f.write(MAGIC)
+
+    def _append(self, kind, meta, blob):
+        with open(self.filename, 'ab') as f:
+            write_record(f, kind, meta, blob)
+
+    def record(self, source, image, board, bonuses, rack, timings, options):
+        resolution = tuple(options.get('resolution', (1920, 1080)))
+        system = options.get('system', 'windows')
+        (height, width, _) = image.shape
+
+        meta = {
+                'frame': self.frame,
+                'source': source,
+                'timings': {stage: round(seconds, 6) for stage, seconds in timings.items()},
+                }
+
+        last = self.last
+
+        # Patches need the previous pixels to diff against, so start over from a keyframe without them
+        if last is None or (self.patches and self.image is None) or self.since_keyframe + 1 >= KEYFRAME_INTERVAL or \
+                (last['resolution'], last['system'], last['size']) != (resolution, system, (width, height)):
+            kind = KEYFRAME
+            meta.update({
+                'resolution': resolution,
+                'system': system,
+                'size': (width, height),
+                'board': encode_cells(board),
+                'bonuses': encode_cells(bonuses),
+                'rack': rack,
+                })
+            blob = encode_png(image)
+            self.since_keyframe = 0
+        else:
+            kind = DELTA
+            board_changes = diff_cells(last['board'], board)
+            bonus_changes = diff_cells(last['bonuses'], bonuses)
+            rack_changes = diff_rack(last['rack'], rack)
+            meta.update({
+                'board': encode_cells(board_changes),
+                'bonuses': encode_cells(bonus_changes),
+                'rack': rack_changes,
+                'rack_length': len(rack),
+                'patched': self.patches,
+                'patches': [],
+                })
+            blob = b''
+
+            if self.patches:
+                for (min_x, min_y, max_x, max_y) in changed_regions(self.image, image):
+                    data = encode_png(image[min_y:max_y, min_x:max_x])
+                    meta['patches'].append([min_x, min_y, max_x, max_y, len(blob), len(data)])
+                    blob += data
+
+            self.since_keyframe += 1
+
+        self._append(kind, meta, blob)
+
+        self.last = {
+                'resolution': resolution,
+                'system': system,
+                'size': (width, height),
+                'board': dict(board),
+                'bonuses': dict(bonuses),
+                'rack': list(rack),
+                }
+        self.image = image.copy() if self.patches else None
+        self.frame += 1
+
+    def record_moves(self, moves, timings):
+        """Attaches the solver results to the frame recorded just before."""
+        meta = {
+                'frame': self.frame - 1,
+                'moves': moves,
+                'timings': {stage: round(seconds, 6) for stage, seconds in timings.items()},
+                }
+
+        self._append(MOVES, meta, b'')
+
+    def record_raw(self, source, image, options, error):
+        """Keeps a whole screenshot that failed before it could be parsed."""
+        meta = {
+                'frame': self.frame,
+                'source': source,
+                'resolution': tuple(options.get('resolution', (1920, 1080))),
+                'window_title': options.get('window_title'),
+                'error': error,
+                }
+
+        self._append(RAW, meta, encode_png(image))
+        self.frame += 1
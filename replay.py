@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+import argparse
+import extract_text
+import recording
+import scrabulizer
+import sys
+import templates
+import time
+
+def build_templates(resolution, cache):
+    if resolution not in cache:
+        cache[resolution] = (templates.build_board_templates(resolution), templates.build_rack_templates(resolution))
+
+    return cache[resolution]
+
+def replay_raw_frame(frame):
+    crop_options = {'resolution': frame['resolution'], 'window_title': frame['window_title']}
+
+    try:
+        bounded, _, _ = extract_text.crop_board(frame['image'], crop_options)
+    except (Exception, SystemExit) as e:
+        return "still fails ({})".format(repr(e))
+
+    (y, x, _) = bounded.shape
+
+    return "now crops to {}x{} as {}".format(x, y, crop_options['system'])
+
+def replay_frame(frame, template_cache, timings, options):
+    dry_run = options.get('dry_run', True)
+    mismatches = []
+    board, bonuses, rack = frame['board'], frame['bonuses'], frame['rack']
+
+    if frame['image'] is not None:
+        started = time.perf_counter()
+        board_templates, rack_templates = build_templates(frame['resolution'], template_cache)
+        parse_options = {'system': frame['system']}
+        image, _, _ = extract_text.to_grayscale(frame['image'])
+
+        board, bonuses = extract_text.parse_board(image, board_templates, parse_options)
+        rack = extract_text.parse_rack(image, rack_templates, parse_options)
+        timings['parse'] += time.perf_counter() - started
+        timings['parsed'] += 1
+
+        for (name, expected, actual) in [('board', frame['board'], board), ('bonuses', frame['bonuses'], bonuses), ('rack', frame['rack'], rack)]:
+            if expected != actual:
+                mismatches.append("{}: expected {}, got {}".format(name, expected, actual))
+
+    # Dry runs never query the solver, so only time and compare it on live replays
+    if dry_run:
+        return mismatches
+
+    started = time.perf_counter()
+    moves = scrabulizer.scrape_scrabulizer(board, rack, bonuses, dry_run)
+    timings['solver'] += time.perf_counter() - started
+    timings['solved'] += 1
+
+    # Frames recorded with --dry_run have no moves to compare against
+    if frame['moves'] and moves != frame['moves']:
+        mismatches.append("moves: expected {}, got {}".format(frame['moves'], moves))
+
+    return mismatches
+
+def replay(filename, options={}):
+    repeat = options.get('repeat', 1)
+    template_cache = {}
+    timings = {'parse': 0.0, 'parsed': 0, 'solver': 0.0, 'solved': 0}
+    frames, failures, raw = 0, 0, 0
+
+    for _ in range(repeat):
+        for frame in recording.SessionReader(filename):
+            # Frames that failed to crop or parse were kept whole; check whether they still fail
+            if frame['raw']:
+                raw += 1
+                print("Frame {} ({}) failed when recorded with {}: {}".format(frame['frame'], frame['source'], frame['error'], replay_raw_frame(frame)))
+                continue
+
+            mismatches = replay_frame(frame, template_cache, timings, options)
+            frames += 1
+
+            if mismatches:
+                failures += 1
+                print("Frame {} ({}) differs from recording:".format(frame['frame'], frame['source']))
+                for mismatch in mismatches:
+                    print("  {}".format(mismatch))
+
+    print("-----------------")
+    print("Replayed {} parsed frames, {} mismatched; {} frames were recorded as failures".format(frames, failures, raw))
+    print("Parsing: {} frames in {:.3f}s ({:.1f} frames/s)".format(timings['parsed'], timings['parse'], timings['parsed'] / timings['parse'] if timings['parse'] else 0))
+
+    if timings['solved']:
+        print("Solver: {} queries in {:.3f}s ({:.1f} queries/s)".format(timings['solved'], timings['solver'], timings['solved'] / timings['solver'] if timings['solver'] else 0))
+
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replay a recorded Snap Attack session through extraction and the solver')
+
+    parser.add_argument('recording')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=1)
+    parser.add_argument('--live', dest='dry_run', action='store_false')
+    parser.set_defaults(dry_run=True)
+
+    args = parser.parse_args()
+
+    failures = replay(args.recording, {'repeat': args.repeat, 'dry_run': args.dry_run})
+
+    sys.exit(1 if failures else 0)